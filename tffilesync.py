@@ -11,60 +11,697 @@ syncer := Syncer(remote_dir='s3://mybucket/tfworkdir', local_dir='/tmp/tf')
 syncer.stop() # call once all the computation is done
 """
 
-import tensorflow as tf
-import tensorflow.io.gfile as gfile
-import tensorflow.compat.v1.logging as logging
+import collections
+import concurrent.futures
+import errno
+import json
+import logging
+import numpy as np
+import os
+import random
+import re
+import shutil
+import stat as stat_module
 import time
 import threading
-from typing import NamedTuple, Dict, Iterable
+from typing import Callable, NamedTuple, Dict, Iterable, List, Optional, Set
+
+try:
+    import watchdog.events
+    import watchdog.observers
+    _WATCHDOG_FOUND = True
+except ImportError:
+    _WATCHDOG_FOUND = False
+
+try:
+    import boto3
+    import boto3.s3.transfer
+    import botocore.exceptions
+    _BOTO3_FOUND = True
+except ImportError:
+    _BOTO3_FOUND = False
+
+try:
+    import xxhash
+    _XXHASH_FOUND = True
+except ImportError:
+    _XXHASH_FOUND = False
+
+# tensorflow is imported lazily, on the first operation that actually needs
+# gfile's filesystem dispatch: a scheme no direct backend handles (e.g.
+# gs://), or an s3:// path when boto3 is not installed. Listing, stats,
+# copies, and deletes all have POSIX and boto3 paths, so a Syncer between
+# plain directories and s3:// never pays the TF runtime's seconds of import
+# time and hundreds of MB of resident memory.
+tf = None
+gfile = None
+_tf_mu = threading.Lock()
+
+
+def _get_gfile():
+    """Returns tensorflow.io.gfile, importing tensorflow on first use. Also
+    extends the copy-error tuples with TF's exception types, which do not
+    exist until the import happens."""
+    global tf, gfile, _COPY_ERRORS, _NONRETRYABLE_ERRORS
+    with _tf_mu:
+        if gfile is None:
+            import tensorflow
+            tf = tensorflow
+            gfile = tensorflow.io.gfile
+            _COPY_ERRORS = (tensorflow.errors.OpError,) + _COPY_ERRORS
+            _NONRETRYABLE_ERRORS = (
+                tensorflow.errors.NotFoundError,
+                tensorflow.errors.PermissionDeniedError) + _NONRETRYABLE_ERRORS
+        return gfile
 
 _FileStat = NamedTuple('_FileStats', [('length', int), ('mtime_nsec', int),
                                       ('is_directory', bool)])
-_DirEntries = Dict[str, _FileStat]
 
 
-def _list_dir(dir_path: str) -> _DirEntries:
-    ents: _DirEntries = {}
-    for name in gfile.listdir(dir_path):
-        path = dir_path + '/' + name
-        stat = gfile.stat(path)
-        ents[name] = _FileStat(length=stat.length,
-                               mtime_nsec=stat.mtime_nsec,
-                               is_directory=stat.is_directory)
-    return ents
+class _DirSnapshot:
+    """A directory listing in structure-of-arrays form: file names in a list
+    with a name->index map, and lengths and mtimes in parallel lists. This
+    keeps the per-entry cost to a few machine words and lets _diff compare
+    two snapshots with vectorized numpy operations rather than per-entry
+    attribute lookups on small tuple objects."""
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.lengths: List[int] = []
+        self.mtimes_nsec: List[int] = []
+        # Content hash of the file when it was last synced, or None when
+        # unknown. Hashes are not part of _diff; they serve as a second
+        # opinion when the stat comparison reports a change.
+        self.hashes: List[Optional[int]] = []
+        self.idx: Dict[str, int] = {}
+        self._version = 0
+        self._sorted_cache = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.idx
+
+    def set(self, name: str, length: int, mtime_nsec: int) -> None:
+        self._version += 1
+        i = self.idx.get(name)
+        if i is None:
+            self.idx[name] = len(self.names)
+            self.names.append(name)
+            self.lengths.append(length)
+            self.mtimes_nsec.append(mtime_nsec)
+            self.hashes.append(None)
+        else:
+            self.lengths[i] = length
+            self.mtimes_nsec[i] = mtime_nsec
+            self.hashes[i] = None
+
+    def get(self, name: str) -> Optional[_FileStat]:
+        i = self.idx.get(name)
+        if i is None:
+            return None
+        return _FileStat(length=self.lengths[i],
+                         mtime_nsec=self.mtimes_nsec[i],
+                         is_directory=False)
+
+    def set_hash(self, name: str, file_hash: Optional[int]) -> None:
+        self.hashes[self.idx[name]] = file_hash
+
+    def get_hash(self, name: str) -> Optional[int]:
+        i = self.idx.get(name)
+        if i is None:
+            return None
+        return self.hashes[i]
+
+    def sorted_names(self):
+        """Returns a (sorted names ndarray, argsort order) pair for
+        vectorized name lookups, cached until the snapshot changes."""
+        if self._sorted_cache is None or self._sorted_cache[0] != self._version:
+            arr = np.asarray(self.names)
+            order = np.argsort(arr)
+            self._sorted_cache = (self._version, arr[order], order)
+        return self._sorted_cache[1], self._sorted_cache[2]
+
+    def discard(self, name: str) -> None:
+        """Removes the entry, if present, by swapping the last entry into
+        its slot."""
+        i = self.idx.pop(name, None)
+        if i is None:
+            return
+        self._version += 1
+        last = len(self.names) - 1
+        if i != last:
+            self.names[i] = self.names[last]
+            self.lengths[i] = self.lengths[last]
+            self.mtimes_nsec[i] = self.mtimes_nsec[last]
+            self.hashes[i] = self.hashes[last]
+            self.idx[self.names[i]] = i
+        self.names.pop()
+        self.lengths.pop()
+        self.mtimes_nsec.pop()
+        self.hashes.pop()
+
 
+# Snapshot size at which _diff switches from the per-name dict gather to the
+# fully vectorized searchsorted alignment; below it the array setup costs
+# more than the Python loop it replaces.
+_VECTOR_DIFF_MIN = 256
 
-def _copy_file(src_dir: str, dest_dir: str, file_name: str):
-    src_path = src_dir + '/' + file_name
-    dest_path = dest_dir + '/' + file_name
-    for retries in range(0, 10):
+
+def _diff(old: _DirSnapshot, new: _DirSnapshot) -> List[str]:
+    """Returns the names in new whose (length, mtime) differ from old's
+    entry for the same name, including names that old lacks entirely."""
+    if not new.names:
+        return []
+    if not old.names:
+        old_idx = np.full(len(new.names), -1, dtype=np.int64)
+    elif len(new.names) >= _VECTOR_DIFF_MIN:
+        # Large directory: align names entirely in numpy (binary search over
+        # the old snapshot's cached sorted names) so no per-entry bytecode
+        # runs in the loop below either.
+        sorted_names, order = old.sorted_names()
+        new_arr = np.asarray(new.names)
+        pos = np.minimum(np.searchsorted(sorted_names, new_arr),
+                         len(sorted_names) - 1)
+        old_idx = np.where(sorted_names[pos] == new_arr, order[pos],
+                           -1).astype(np.int64)
+    else:
+        old_idx = np.fromiter((old.idx.get(name, -1) for name in new.names),
+                              dtype=np.int64,
+                              count=len(new.names))
+    # Compare the length and mtime columns exactly, as two branchless vector
+    # compares. Index -1 selects the sentinel slot appended to the old
+    # arrays; missing names are handled separately by the old_idx < 0 term,
+    # so the sentinel value itself does not matter.
+    old_lengths = np.asarray(old.lengths + [0], dtype=np.int64)
+    old_mtimes = np.asarray(old.mtimes_nsec + [0], dtype=np.int64)
+    changed = ((old_idx < 0)
+               | (old_lengths[old_idx] != np.asarray(new.lengths,
+                                                     dtype=np.int64))
+               | (old_mtimes[old_idx] != np.asarray(new.mtimes_nsec,
+                                                    dtype=np.int64)))
+    return [new.names[i] for i in np.nonzero(changed)[0]]
+
+
+# Key of the S3 user-metadata entry (x-amz-meta-mtime) that records the
+# source file's mtime at upload time. The server's own LastModified is the
+# PUT timestamp, which never matches the local mtime and would make every
+# full sync re-upload unchanged files.
+_MTIME_METADATA_KEY = 'mtime'
+
+
+def _default_exclude(name: str) -> bool:
+    """The default file filter: skips dotfiles (including the syncer's own
+    state file) and the transient *.tmp files TF writes while
+    checkpointing."""
+    return name.startswith('.') or name.endswith('.tmp') or '.tmp-' in name
+
+
+def _list_dir(dir_path: str,
+              exclude: Callable[[str], bool] = _default_exclude
+              ) -> _DirSnapshot:
+    if '://' not in dir_path:
+        # A raw scandir is a single getdents pass plus one cheap stat
+        # syscall per entry, bypassing gfile's per-call scheme dispatch,
+        # which costs an order of magnitude more than the syscall itself.
+        snap = _DirSnapshot()
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if exclude(entry.name) or entry.is_dir():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snap.set(entry.name, st.st_size, st.st_mtime_ns)
+        return snap
+    if _BOTO3_FOUND and dir_path.startswith('s3://'):
+        names = _s3_list_names(dir_path)
+    else:
+        names = _get_gfile().listdir(dir_path)
+    return _stat_files(dir_path, (name for name in names if not exclude(name)))
+
+
+# Number of concurrent stat calls issued by _stat_files. Stats are
+# latency-bound network RPCs on s3:// and gs:// paths, so issuing them in
+# parallel collapses N round-trips into roughly N / _STAT_PARALLELISM.
+_STAT_PARALLELISM = 32
+
+
+def _stat_path(path: str) -> Optional[_FileStat]:
+    """Stats one file. Returns None if the file does not exist."""
+    if '://' not in path:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return _FileStat(length=st.st_size,
+                         mtime_nsec=st.st_mtime_ns,
+                         is_directory=stat_module.S_ISDIR(st.st_mode))
+    if _BOTO3_FOUND and path.startswith('s3://'):
+        bucket, key = path[len('s3://'):].split('/', 1)
         try:
-            gfile.copy(src_path, dest_path, overwrite=True)
+            head = _get_s3_client().head_object(Bucket=bucket, Key=key)
+        except botocore.exceptions.ClientError as ex:
+            if ex.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+        meta_mtime = head.get('Metadata', {}).get(_MTIME_METADATA_KEY)
+        if meta_mtime is not None:
+            mtime_nsec = int(meta_mtime)
+        else:
+            mtime_nsec = int(head['LastModified'].timestamp() * 1e9)
+        return _FileStat(length=head['ContentLength'],
+                         mtime_nsec=mtime_nsec,
+                         is_directory=False)
+    try:
+        stat = _get_gfile().stat(path)
+    except tf.errors.NotFoundError:
+        # The file was removed after it was listed or reported changed.
+        return None
+    return _FileStat(length=stat.length,
+                     mtime_nsec=stat.mtime_nsec,
+                     is_directory=stat.is_directory)
+
+
+def _stat_files(dir_path: str, names: Iterable[str]) -> _DirSnapshot:
+    names = list(names)
+    # Join the directory prefix once instead of re-concatenating it for
+    # every entry.
+    base = dir_path.rstrip('/') + '/'
+    snap = _DirSnapshot()
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=_STAT_PARALLELISM) as pool:
+        for name, ent in zip(names,
+                             pool.map(lambda name: _stat_path(base + name),
+                                      names)):
+            if ent is not None and not ent.is_directory:
+                snap.set(name, ent.length, ent.mtime_nsec)
+    return snap
+
+
+# Local files larger than this are uploaded to s3:// destinations as parallel
+# multipart uploads rather than a single-stream PUT. 16 MiB parts stay well
+# above the 5 MiB S3 part-size minimum.
+_S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+_S3_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+_S3_UPLOAD_PARALLELISM = 8
+
+_s3_client_mu = threading.Lock()
+_s3_client = None
+
+# _get_gfile prepends tf.errors.OpError once tensorflow is loaded.
+if _BOTO3_FOUND:
+    _COPY_ERRORS = (OSError, botocore.exceptions.BotoCoreError,
+                    botocore.exceptions.ClientError)
+else:
+    _COPY_ERRORS = (OSError,)
+
+
+def _get_s3_client():
+    """Returns a process-wide boto3 S3 client, creating it on first use."""
+    global _s3_client
+    with _s3_client_mu:
+        if _s3_client is None:
+            _s3_client = boto3.client('s3')
+        return _s3_client
+
+
+if _BOTO3_FOUND:
+    _S3_TRANSFER_CONFIG = boto3.s3.transfer.TransferConfig(
+        multipart_threshold=_S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=_S3_MULTIPART_CHUNKSIZE,
+        max_concurrency=_S3_UPLOAD_PARALLELISM)
+
+
+def _s3_upload_file(src_path: str, dest_path: str) -> None:
+    """Uploads a local file to an s3:// path, stamping the local mtime as
+    user metadata. Files above _S3_MULTIPART_THRESHOLD become parallel
+    multipart uploads."""
+    bucket, key = dest_path[len('s3://'):].split('/', 1)
+    metadata = {_MTIME_METADATA_KEY: str(os.stat(src_path).st_mtime_ns)}
+    _get_s3_client().upload_file(src_path,
+                                 bucket,
+                                 key,
+                                 Config=_S3_TRANSFER_CONFIG,
+                                 ExtraArgs={'Metadata': metadata})
+
+
+def _s3_download_file(src_path: str, dest_path: str) -> None:
+    """Downloads an s3:// object to a local file, restoring the mtime
+    recorded as user metadata at upload time. Objects above
+    _S3_MULTIPART_THRESHOLD download as parallel ranged GETs."""
+    bucket, key = src_path[len('s3://'):].split('/', 1)
+    _get_s3_client().download_file(bucket, key, dest_path,
+                                   Config=_S3_TRANSFER_CONFIG)
+    src_stat = _stat_path(src_path)
+    if src_stat is not None:
+        os.utime(dest_path, ns=(src_stat.mtime_nsec, src_stat.mtime_nsec))
+
+
+def _s3_list_names(dir_path: str) -> List[str]:
+    """Lists the objects directly under an s3:// directory with paginated
+    ListObjectsV2 calls; each round-trip covers up to 1000 keys."""
+    bucket, _, prefix = dir_path[len('s3://'):].partition('/')
+    prefix = prefix.rstrip('/')
+    if prefix:
+        prefix += '/'
+    names = []
+    paginator = _get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix,
+                                   Delimiter='/'):
+        for obj in page.get('Contents', []):
+            name = obj['Key'][len(prefix):]
+            if name:
+                names.append(name)
+    return names
+
+
+_HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _hash_file(path: str) -> Optional[int]:
+    """Returns the xxh3 hash of a local file's contents, or None if the file
+    cannot be read."""
+    digest = xxhash.xxh3_64()
+    try:
+        with open(path, 'rb') as fd:
+            while True:
+                chunk = fd.read(_HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.intdigest()
+
+
+# Bytes moved per os.copy_file_range call for local-to-local copies.
+_LOCAL_COPY_CHUNK = 1 << 30
+
+
+def _copy_local_file(src_path: str, dest_path: str) -> None:
+    """Copies a local file without moving the bytes through userspace.
+    os.copy_file_range keeps the copy in the kernel and can reflink on
+    filesystems that support it; cross-device copies and filesystems that
+    lack the syscall fall back to shutil.copyfile."""
+    if not hasattr(os, 'copy_file_range'):
+        shutil.copyfile(src_path, dest_path)
+        return
+    src_fd = os.open(src_path, os.O_RDONLY)
+    try:
+        dest_fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        try:
+            while True:
+                try:
+                    copied = os.copy_file_range(src_fd, dest_fd,
+                                                _LOCAL_COPY_CHUNK)
+                except OSError as ex:
+                    if ex.errno in (errno.EXDEV, errno.ENOSYS,
+                                    errno.EOPNOTSUPP, errno.EINVAL):
+                        shutil.copyfile(src_path, dest_path)
+                        return
+                    raise
+                if copied == 0:
+                    return
+        finally:
+            os.close(dest_fd)
+    finally:
+        os.close(src_fd)
+
+
+# Transient copy errors are retried with jittered exponential backoff until
+# _RETRY_BUDGET_S has elapsed. Jitter decorrelates retry storms from multiple
+# Syncers hitting a throttled bucket, and the budget bounds how long one
+# failing file can occupy a copy-pool worker.
+_RETRY_BUDGET_S = 60
+_RETRY_MAX_SLEEP_S = 30
+
+# _get_gfile prepends TF's NotFoundError/PermissionDeniedError once
+# tensorflow is loaded.
+_NONRETRYABLE_ERRORS = (FileNotFoundError, PermissionError)
+_NONRETRYABLE_S3_CODES = ('404', 'NoSuchKey', '403', 'AccessDenied')
+
+
+def _is_retryable(ex: Exception) -> bool:
+    if isinstance(ex, _NONRETRYABLE_ERRORS):
+        return False
+    if _BOTO3_FOUND and isinstance(ex, botocore.exceptions.ClientError):
+        return ex.response['Error']['Code'] not in _NONRETRYABLE_S3_CODES
+    return True
+
+
+def _copy_mode(src_dir: str, dest_dir: str) -> str:
+    """Classifies a (src, dest) directory pair once so that per-file copies
+    need no URI sniffing: 's3' uploads and 's3_download' downloads through
+    boto3, 'local' copies in the kernel, 'gfile' goes through TF's
+    filesystem dispatch. The schemes are fixed for a Syncer's lifetime, so
+    callers cache the result."""
+    if _BOTO3_FOUND and dest_dir.startswith('s3://') and '://' not in src_dir:
+        return 's3'
+    if _BOTO3_FOUND and src_dir.startswith('s3://') and '://' not in dest_dir:
+        return 's3_download'
+    if '://' not in src_dir and '://' not in dest_dir:
+        return 'local'
+    return 'gfile'
+
+
+def _copy_file(src_dir: str,
+               dest_dir: str,
+               file_name: str,
+               mode: Optional[str] = None) -> bool:
+    """Copies a file, retrying transient errors. Returns true on success."""
+    if mode is None:
+        mode = _copy_mode(src_dir, dest_dir)
+    src_path = f'{src_dir}/{file_name}'
+    dest_path = f'{dest_dir}/{file_name}'
+    dest_is_local = '://' not in dest_dir
+    start = time.monotonic()
+    retries = 0
+    while True:
+        try:
+            if mode == 's3':
+                _s3_upload_file(src_path, dest_path)
+            elif mode == 's3_download':
+                _s3_download_file(src_path, dest_path)
+            elif mode == 'local':
+                _copy_local_file(src_path, dest_path)
+                mtime_nsec = os.stat(src_path).st_mtime_ns
+                os.utime(dest_path, ns=(mtime_nsec, mtime_nsec))
+            else:
+                _get_gfile().copy(src_path, dest_path, overwrite=True)
+                if dest_is_local:
+                    # Preserve the source mtime so later stat comparisons see
+                    # an unchanged file as unchanged.
+                    src_stat = _stat_path(src_path)
+                    if src_stat is not None:
+                        os.utime(dest_path,
+                                 ns=(src_stat.mtime_nsec,
+                                     src_stat.mtime_nsec))
             logging.info("copy %s->%s succeeded (retry %d)", src_path,
                          dest_path, retries)
-            return
-        except tf.errors.OpError as ex:
+            return True
+        except _COPY_ERRORS as ex:
+            if not _is_retryable(ex):
+                logging.error("copy %s->%s: non-retryable error: %s",
+                              src_path, dest_path, ex)
+                return False
+            if time.monotonic() - start > _RETRY_BUDGET_S:
+                logging.error("copy %s->%s: giving up after %d retries: %s",
+                              src_path, dest_path, retries, ex)
+                return False
             logging.error("copy %s->%s (retry %d): %s", src_path, dest_path,
                           retries, ex)
-            time.sleep(1.5**retries)
+            time.sleep(
+                min(_RETRY_MAX_SLEEP_S,
+                    (2**retries) * 0.1 * random.uniform(0.5, 1.5)))
+            retries += 1
+
+
+def _is_manifest(name: str) -> bool:
+    """True for TF checkpoint 'commit marker' files: the top-level
+    'checkpoint' state file and per-checkpoint .index files. They name data
+    shards that must already be present for the checkpoint to be readable,
+    so the sync loop uploads them only after their siblings."""
+    return name == 'checkpoint' or name.endswith('.index')
+
+
+# Matches the per-checkpoint files TF writes for one checkpoint prefix:
+# <stem>.index, <stem>.meta, and <stem>.data-XXXXX-of-YYYYY.
+_CKPT_FILE_RE = re.compile(r'(.+)\.(?:index|meta|data-\d+-of-\d+)$')
+
+
+def _ckpt_stem(name: str) -> Optional[str]:
+    """Returns the checkpoint prefix (e.g. 'model.ckpt-5') a file belongs
+    to, or None for files that are not part of a checkpoint."""
+    m = _CKPT_FILE_RE.match(name)
+    return m.group(1) if m else None
+
+
+def _checkpoint_stems(path: str) -> Optional[Set[str]]:
+    """Returns the checkpoint prefixes named by a TF 'checkpoint' state
+    file, or None if the file cannot be read or parsed. The file is a text
+    proto whose values are quoted checkpoint paths."""
+    try:
+        with open(path) as fd:
+            text = fd.read()
+    except OSError:
+        return None
+    stems = {os.path.basename(p) for p in re.findall(r'"([^"]+)"', text)}
+    return stems or None
+
+
+def _delete_file(dir_path: str, file_name: str) -> bool:
+    """Deletes a file, retrying transient errors. Returns true on success or
+    if the file is already gone."""
+    path = f'{dir_path}/{file_name}'
+    start = time.monotonic()
+    retries = 0
+    while True:
+        try:
+            if '://' not in path:
+                os.remove(path)
+            elif _BOTO3_FOUND and path.startswith('s3://'):
+                # DeleteObject is idempotent; a missing key is not an error.
+                bucket, key = path[len('s3://'):].split('/', 1)
+                _get_s3_client().delete_object(Bucket=bucket, Key=key)
+            else:
+                _get_gfile().remove(path)
+            logging.info("delete %s succeeded (retry %d)", path, retries)
+            return True
+        except FileNotFoundError:
+            return True
+        except _COPY_ERRORS as ex:
+            if tf is not None and isinstance(ex, tf.errors.NotFoundError):
+                return True
+            if not _is_retryable(ex):
+                logging.error("delete %s: non-retryable error: %s", path, ex)
+                return False
+            if time.monotonic() - start > _RETRY_BUDGET_S:
+                logging.error("delete %s: giving up after %d retries: %s",
+                              path, retries, ex)
+                return False
+            logging.error("delete %s (retry %d): %s", path, retries, ex)
+            time.sleep(
+                min(_RETRY_MAX_SLEEP_S,
+                    (2**retries) * 0.1 * random.uniform(0.5, 1.5)))
+            retries += 1
+
+
+# Number of files copied concurrently. Each copy is a latency-bound transfer,
+# so running them on separate streams makes a multi-file sync cost roughly the
+# slowest transfer rather than the sum of all of them.
+_COPY_PARALLELISM = 8
 
 
 _FULL_SYNC_INTERVAL_S = 6 * 60
 
+# How long the loop sleeps between directory scans when kernel change
+# notification is unavailable.
+_POLL_INTERVAL_S = 60.0
+
+# TF writes the several files of one checkpoint in quick succession. After a
+# wake-up the loop lets the event stream stay quiet for _DEBOUNCE_S before
+# snapshotting, but never waits longer than _DEBOUNCE_MAX_S in total, so a
+# file that is rewritten continuously cannot stall the pass. A local file
+# whose mtime is younger than _MIN_QUIET_S is assumed to still be mid-write
+# and is pushed back onto the change queue for the next wake-up rather than
+# uploaded half-written.
+_DEBOUNCE_S = 0.25
+_DEBOUNCE_MAX_S = 2.0
+_MIN_QUIET_S = 0.2
+_MIN_QUIET_NSEC = int(_MIN_QUIET_S * 1e9)
+
+# Name of the file in local_dir that records the stats of files known to be
+# in sync with remote_dir. It lets a restarted Syncer resume from the last
+# known state instead of re-copying files that have not changed since.
+_STATE_FILE_NAME = '.tffilesync_state.json'
+
+if _WATCHDOG_FOUND:
+
+    class _WatchHandler(watchdog.events.FileSystemEventHandler):
+        """Forwards kernel file-change events to the Syncer."""
+        def __init__(self, syncer: 'Syncer'):
+            self._syncer = syncer
+
+        def on_created(self, event) -> None:
+            self._syncer._note_change(event.src_path)
+
+        def on_modified(self, event) -> None:
+            self._syncer._note_change(event.src_path)
+
+        def on_moved(self, event) -> None:
+            self._syncer._note_change(event.src_path)
+            self._syncer._note_change(event.dest_path)
+
+        def on_deleted(self, event) -> None:
+            self._syncer._note_change(event.src_path)
+
 
 class Syncer:
-    def __init__(self, remote_dir: str, local_dir: str):
+    def __init__(self,
+                 remote_dir: str,
+                 local_dir: str,
+                 exclude: Callable[[str], bool] = _default_exclude,
+                 propagate_deletes: bool = False):
+        """exclude decides, given a file name, whether the syncer should
+        ignore the file. The default skips dotfiles and TF's transient
+        *.tmp checkpoint outputs; override it to match other naming
+        conventions.
+
+        propagate_deletes makes a file deleted under local_dir also be
+        deleted from remote_dir. It is off by default so that the remote
+        directory never loses data without an explicit opt-in."""
         self._remote_dir = remote_dir
         self._local_dir = local_dir
+        self._exclude = exclude
+        self._propagate_deletes = propagate_deletes
+        # The directory schemes never change, so resolve every per-path
+        # dispatch decision once here instead of on each call.
+        self._local_is_posix = '://' not in local_dir
+        self._upload_mode = _copy_mode(local_dir, remote_dir)
+        self._download_mode = _copy_mode(remote_dir, local_dir)
         self._mu = threading.Lock()
         self._cond = threading.Condition(lock=self._mu)
         self._stopping = False
         self._epoch = 0
-        gfile.makedirs(local_dir)
+        self._copy_failures = 0
+        self._kicked = False
+        self._changed: collections.deque = collections.deque()
+        # Names with an upload currently in flight. Deduplicates work when
+        # back-to-back passes flag the same file before the first upload of
+        # it has finished.
+        self._inflight: Set[str] = set()
+        self._inflight_mu = threading.Lock()
+        # State persistence needs atomic renames, so it is only enabled when
+        # local_dir is a plain POSIX path.
+        self._state_path: Optional[str] = None
+        if self._local_is_posix:
+            self._state_path = os.path.join(local_dir, _STATE_FILE_NAME)
+        if self._local_is_posix:
+            os.makedirs(local_dir, exist_ok=True)
+        else:
+            _get_gfile().makedirs(local_dir)
+
+        # Prefer kernel file-change notification over polling. It is available
+        # only when local_dir is a plain POSIX path; for other paths (e.g., a
+        # gs:// URI) the loop falls back to listing the directory every minute.
+        self._watcher = None
+        if _WATCHDOG_FOUND and self._local_is_posix:
+            self._watcher = watchdog.observers.Observer()
+            self._watcher.schedule(_WatchHandler(self), local_dir)
+            self._watcher.start()
 
-        remote_ents = _list_dir(remote_dir)
-        for name, ent in remote_ents.items():
-            _copy_file(remote_dir, local_dir, name)
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=_COPY_PARALLELISM)
+        local_ents = _list_dir(local_dir, exclude)
+        remote_ents = _list_dir(remote_dir, exclude)
+        futures = [
+            self._pool.submit(_copy_file, remote_dir, local_dir, name,
+                              self._download_mode)
+            for name in _diff(local_ents, remote_ents)
+        ]
+        self._copy_failures += sum(1 for f in futures if not f.result())
 
         self._thread = threading.Thread(target=self._loop)
         self._thread.start()
@@ -75,11 +712,16 @@ class Syncer:
             self._stopping = True
             self._cond.notify()
         self._thread.join()
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher.join()
+        self._pool.shutdown(wait=True)
 
     def kick(self) -> None:
         """Kick wakes up the background thread that watches the local directory. It does
         not wait for the thread to finish syncing."""
         with self._mu:
+            self._kicked = True
             self._cond.notify()
 
     def epoch(self) -> int:
@@ -87,36 +729,279 @@ class Syncer:
         with self._mu:
             return self._epoch
 
-    def _loop(self) -> None:
-        def _has_file(dir_ents: _DirEntries, name: str, want_stat: _FileStat):
-            if name not in dir_ents:
-                return False
-            got_stat = dir_ents[name]
-            if got_stat.length != want_stat.length:
-                return False
-            if got_stat.mtime_nsec != want_stat.mtime_nsec:
-                return False
-            return True
+    def copy_failures(self) -> int:
+        """Returns the number of copies that failed for good (non-retryable
+        error or exhausted retry budget). Mainly for monitoring."""
+        with self._mu:
+            return self._copy_failures
+
+    def _note_change(self, path: str) -> None:
+        """Called by the watchdog handler when a file under local_dir changes."""
+        name = os.path.basename(path)
+        if self._exclude(name):
+            return
+        with self._mu:
+            self._changed.append(name)
+            self._cond.notify()
+
+    def _submit_upload(self, name: str):
+        """Submits an upload of local_dir/name to the copy pool, unless one
+        is already in flight. Returns the future, or None if skipped."""
+        with self._inflight_mu:
+            if name in self._inflight:
+                return None
+            self._inflight.add(name)
 
-        src_ents: _DirEntries = {}
+        def _run() -> bool:
+            try:
+                return _copy_file(self._local_dir, self._remote_dir,
+                                  name, self._upload_mode)
+            finally:
+                with self._inflight_mu:
+                    self._inflight.discard(name)
+
+        return self._pool.submit(_run)
+
+    def _load_state(self) -> _DirSnapshot:
+        """Reads the entries recorded by the last run. Returns an empty
+        snapshot if there is no usable state."""
+        snap = _DirSnapshot()
+        if self._state_path is None:
+            return snap
+        try:
+            with open(self._state_path) as fd:
+                state = json.load(fd)
+            if (state.get('remote_dir') != self._remote_dir
+                    or state.get('local_dir') != self._local_dir):
+                # Stale state from a differently configured Syncer.
+                return snap
+            for name, ent in state.get('files', {}).items():
+                snap.set(name, ent['length'], ent['mtime_nsec'])
+                snap.set_hash(name, ent.get('hash'))
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return _DirSnapshot()
+        return snap
+
+    def _save_state(self, ents: _DirSnapshot) -> None:
+        if self._state_path is None:
+            return
+        state = {
+            'remote_dir': self._remote_dir,
+            'local_dir': self._local_dir,
+            'files': {
+                name: {
+                    'length': length,
+                    'mtime_nsec': mtime_nsec,
+                    'hash': file_hash
+                }
+                for name, length, mtime_nsec, file_hash in zip(
+                    ents.names, ents.lengths, ents.mtimes_nsec, ents.hashes)
+            },
+        }
+        tmp_path = self._state_path + '.tmp'
+        with open(tmp_path, 'w') as fd:
+            json.dump(state, fd)
+        os.rename(tmp_path, self._state_path)
+
+    def _loop(self) -> None:
+        src_ents = self._load_state()
+        local_base = self._local_dir.rstrip('/') + '/'
         last_full_sync_time = time.time()
         done = False
         while not done:
+            changed: Optional[Set[str]] = None
             with self._mu:
-                self._epoch += 1
-                self._cond.wait(60.0)
+                if self._watcher is not None:
+                    # With change notification there is nothing to poll for:
+                    # sleep until the next full-sync deadline unless an
+                    # event, kick, or stop arrives. wait_for ignores
+                    # spurious wake-ups, so an idle Syncer causes no
+                    # periodic CPU activity.
+                    deadline = last_full_sync_time + _FULL_SYNC_INTERVAL_S
+                    self._cond.wait_for(
+                        lambda: (self._stopping or self._kicked or
+                                 bool(self._changed)),
+                        timeout=max(0.0, deadline - time.time()))
+                elif not (self._stopping or self._kicked or self._changed):
+                    self._cond.wait(_POLL_INTERVAL_S)
+                # Coalesce a burst of change events into one sync pass: keep
+                # absorbing notifications until none arrives for _DEBOUNCE_S,
+                # but for at most _DEBOUNCE_MAX_S overall.
+                debounce_deadline = time.monotonic() + _DEBOUNCE_MAX_S
+                while (not self._stopping
+                       and time.monotonic() < debounce_deadline
+                       and self._cond.wait(_DEBOUNCE_S)):
+                    pass
                 if self._stopping:
                     # Do full sync for one last time
-                    src_ents = {}
                     done = True
+                elif self._watcher is not None and not self._kicked:
+                    # Restat only the files named in change events.
+                    changed = set(self._changed)
+                self._changed.clear()
+                self._kicked = False
 
             now = time.time()
-            if now - last_full_sync_time >= _FULL_SYNC_INTERVAL_S:
-                src_ents = {}
-
-            new_ents = _list_dir(self._local_dir)
-            for name, ent in new_ents.items():
-                if not _has_file(src_ents, name, ent):
-                    # file added or updated
-                    _copy_file(self._local_dir, self._remote_dir, name)
-                    src_ents[name] = ent
+            if now - last_full_sync_time >= _FULL_SYNC_INTERVAL_S or done:
+                # Reconcile the full directory periodically to recover from
+                # dropped events (e.g., an inotify queue overflow). Diffing
+                # the fresh listing against the retained sync state catches
+                # anything an event missed while re-uploading only files
+                # whose stats actually changed.
+                last_full_sync_time = now
+                changed = None
+
+            if changed is not None:
+                new_ents = _stat_files(self._local_dir, changed)
+            else:
+                new_ents = _list_dir(self._local_dir, self._exclude)
+            # The sync-state file itself must never be uploaded.
+            new_ents.discard(_STATE_FILE_NAME)
+            new_ents.discard(_STATE_FILE_NAME + '.tmp')
+            ready = _diff(src_ents, new_ents)
+            copied_any = False
+            deferred: List[str] = []
+            # A local file whose mtime is younger than _MIN_QUIET_S is
+            # assumed to still be mid-write; it is re-queued for the next
+            # wake-up so that a continuously-rewritten file never holds up
+            # this pass's other uploads. The final pass must capture
+            # everything now, so it defers nothing. The mtime-vs-wall-clock
+            # comparison is only meaningful when local_dir is on this
+            # machine.
+            if not done and self._local_is_posix and ready:
+                now_nsec = time.time_ns()
+                quiet = []
+                for name in ready:
+                    age = now_nsec - new_ents.get(name).mtime_nsec
+                    if age < _MIN_QUIET_NSEC:
+                        deferred.append(name)
+                    else:
+                        quiet.append(name)
+                ready = quiet
+            # With xxhash installed, a changed stat gets a second opinion
+            # from the content hash: a file rewritten with identical
+            # bytes (or a filesystem with coarse mtimes) is recorded as
+            # synced without being re-uploaded.
+            hashes: Dict[str, Optional[int]] = {}
+            if _XXHASH_FOUND and self._local_is_posix:
+                skipped = []
+                for name in ready:
+                    new_hash = _hash_file(local_base + name)
+                    hashes[name] = new_hash
+                    if (new_hash is not None
+                            and new_hash == src_ents.get_hash(name)):
+                        ent = new_ents.get(name)
+                        src_ents.set(name, ent.length, ent.mtime_nsec)
+                        src_ents.set_hash(name, new_hash)
+                        copied_any = True
+                        skipped.append(name)
+                ready = [name for name in ready if name not in skipped]
+
+            def _upload_batch(names: List[str]) -> List[str]:
+                """Uploads the files concurrently and records the ones
+                that succeeded. Returns the names this pass did not
+                upload: failed copies, plus names whose upload from an
+                earlier pass is still in flight."""
+                futures = {}
+                for name in names:
+                    future = self._submit_upload(name)
+                    if future is not None:
+                        futures[name] = future
+                not_uploaded = [name for name in names if name not in futures]
+                for name, future in futures.items():
+                    # Record the mtime only for files that actually
+                    # copied, so that failed ones are retried on the
+                    # next wake-up.
+                    if future.result():
+                        ent = new_ents.get(name)
+                        src_ents.set(name, ent.length, ent.mtime_nsec)
+                        src_ents.set_hash(name, hashes.get(name))
+                    else:
+                        not_uploaded.append(name)
+                        with self._mu:
+                            self._copy_failures += 1
+                return not_uploaded
+
+            # Upload data shards first; a checkpoint manifest goes out only
+            # once every shard of its own checkpoint is up, so a reader of
+            # the remote directory never sees a manifest that points at
+            # shards that have not arrived yet. Files of other checkpoints
+            # (or non-checkpoint files, e.g. a hot tfevents log) do not
+            # hold a manifest back.
+            shards = [name for name in ready if not _is_manifest(name)]
+            manifests = [name for name in ready if _is_manifest(name)]
+            failed = _upload_batch(shards)
+            if manifests:
+                failed_stems = {s for s in map(_ckpt_stem, failed) if s}
+                deferred_stems = {s for s in map(_ckpt_stem, deferred) if s}
+
+                def _blocked_by(name: str, stems: Set[str]) -> bool:
+                    if not stems:
+                        return False
+                    if name != 'checkpoint':
+                        return _ckpt_stem(name) in stems
+                    # The top-level state file is held back only when a
+                    # checkpoint it names is incomplete; if it cannot be
+                    # parsed, assume it names every pending checkpoint.
+                    named = (_checkpoint_stems(local_base + name)
+                             if self._local_is_posix else None)
+                    return bool(stems if named is None else named & stems)
+
+                upload_now = []
+                for name in manifests:
+                    if _blocked_by(name, failed_stems):
+                        # Leave the manifest unrecorded; the next wake-up
+                        # retries it together with the failed shards.
+                        logging.error(
+                            "holding back manifest upload %s: "
+                            "some of its data shards failed to copy", name)
+                    elif _blocked_by(name, deferred_stems):
+                        # Sibling shards are still being written; the
+                        # manifest waits for them.
+                        deferred.append(name)
+                    else:
+                        upload_now.append(name)
+                if upload_now:
+                    _upload_batch(upload_now)
+            copied_any = copied_any or bool(ready)
+            if deferred:
+                # Revisit the mid-write files on the next wake-up, after
+                # the usual debounce.
+                with self._mu:
+                    self._changed.extend(deferred)
+                    self._cond.notify()
+
+            if self._propagate_deletes:
+                # Sweep files that were synced before but have disappeared
+                # locally. On an event-driven pass only the names in the
+                # events can have gone; a full listing allows the complete
+                # stale-key sweep.
+                if changed is not None:
+                    stale = [
+                        name for name in changed
+                        if name in src_ents and name not in new_ents
+                    ]
+                else:
+                    stale = [
+                        name for name in src_ents.names
+                        if name not in new_ents
+                    ]
+                del_futures = {
+                    name: self._pool.submit(_delete_file, self._remote_dir,
+                                            name)
+                    for name in stale
+                }
+                for name in stale:
+                    if del_futures[name].result():
+                        src_ents.discard(name)
+                        copied_any = True
+
+            if copied_any:
+                self._save_state(src_ents)
+
+            if changed is None:
+                # Count only full sync passes, and only once the pass has
+                # finished, so that a kick() caller polling epoch() does not
+                # observe an increment before its changes have been synced.
+                with self._mu:
+                    self._epoch += 1
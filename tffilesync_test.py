@@ -1,13 +1,13 @@
-import tensorflow as tf
-import tensorflow.io.gfile as gfile
-import tensorflow.compat.v1.logging as logging
 import tffilesync
+import json
+import logging
+import sys
 import time
 import os
 import unittest
 import tempfile
 
-logging.set_verbosity(logging.DEBUG)
+logging.basicConfig(level=logging.DEBUG)
 
 
 def _kick_sync(syncer: tffilesync.Syncer):
@@ -22,6 +22,12 @@ def _read_file(path: str) -> str:
         return fd.read()
 
 
+def _list_visible(dir_path: str) -> list:
+    """Lists a directory, hiding the syncer's own state file."""
+    return sorted(name for name in os.listdir(dir_path)
+                  if not name.startswith('.tffilesync_state'))
+
+
 class TestSync(unittest.TestCase):
     def test_basic(self):
         with tempfile.TemporaryDirectory() as remotedir, \
@@ -29,15 +35,19 @@ class TestSync(unittest.TestCase):
             with open(remotedir + '/f0.txt', 'w') as fd:
                 fd.write('hello0')
             syncer = tffilesync.Syncer(remotedir, localdir)
-            self.assertListEqual(gfile.listdir(localdir), ['f0.txt'])
+            self.assertListEqual(_list_visible(localdir), ['f0.txt'])
             self.assertEqual(_read_file(localdir + '/f0.txt'), 'hello0')
             with open(localdir + '/f1.txt', 'w') as fd:
                 fd.write('hello1')
+            # Directories and transient files must not be synced.
+            os.mkdir(localdir + '/subdir')
+            with open(localdir + '/f2.tmp', 'w') as fd:
+                fd.write('scratch')
             _kick_sync(syncer)
 
-            self.assertListEqual(sorted(gfile.listdir(localdir)),
-                                 ['f0.txt', 'f1.txt'])
-            self.assertListEqual(sorted(gfile.listdir(remotedir)),
+            self.assertListEqual(_list_visible(localdir),
+                                 ['f0.txt', 'f1.txt', 'f2.tmp', 'subdir'])
+            self.assertListEqual(sorted(os.listdir(remotedir)),
                                  ['f0.txt', 'f1.txt'])
             self.assertEqual(_read_file(remotedir + '/f0.txt'), 'hello0')
             self.assertEqual(_read_file(remotedir + '/f1.txt'), 'hello1')
@@ -47,11 +57,211 @@ class TestSync(unittest.TestCase):
                 fd.write('hello2')
             _kick_sync(syncer)
             self.assertEqual(_read_file(remotedir + '/f1.txt'), 'hello2')
-            self.assertListEqual(sorted(gfile.listdir(remotedir)),
+            self.assertListEqual(sorted(os.listdir(remotedir)),
+                                 ['f0.txt', 'f1.txt'])
+
+            syncer.stop()
+            # Syncing between plain directories must not pull in the TF
+            # runtime; tensorflow is only imported for gfile-only schemes.
+            self.assertNotIn('tensorflow', sys.modules)
+
+    def test_propagate_deletes(self):
+        with tempfile.TemporaryDirectory() as remotedir, \
+             tempfile.TemporaryDirectory() as localdir:
+            with open(localdir + '/f0.txt', 'w') as fd:
+                fd.write('hello0')
+            with open(localdir + '/f1.txt', 'w') as fd:
+                fd.write('hello1')
+            syncer = tffilesync.Syncer(remotedir, localdir,
+                                       propagate_deletes=True)
+            _kick_sync(syncer)
+            self.assertListEqual(sorted(os.listdir(remotedir)),
                                  ['f0.txt', 'f1.txt'])
 
+            os.remove(localdir + '/f1.txt')
+            _kick_sync(syncer)
+            self.assertListEqual(os.listdir(remotedir), ['f0.txt'])
+            syncer.stop()
+
+    def test_propagate_deletes_full_sync(self):
+        # A deletion must also be caught by the periodic full-sync pass,
+        # which gets no change notification (e.g., the polling fallback, or
+        # a dropped inotify event).
+        saved = (tffilesync._WATCHDOG_FOUND, tffilesync._POLL_INTERVAL_S,
+                 tffilesync._FULL_SYNC_INTERVAL_S)
+        tffilesync._WATCHDOG_FOUND = False
+        tffilesync._POLL_INTERVAL_S = 0.2
+        tffilesync._FULL_SYNC_INTERVAL_S = 0.1
+        try:
+            with tempfile.TemporaryDirectory() as remotedir, \
+                 tempfile.TemporaryDirectory() as localdir:
+                with open(localdir + '/f0.txt', 'w') as fd:
+                    fd.write('hello0')
+                with open(localdir + '/f1.txt', 'w') as fd:
+                    fd.write('hello1')
+                syncer = tffilesync.Syncer(remotedir, localdir,
+                                           propagate_deletes=True)
+                _kick_sync(syncer)
+                self.assertListEqual(sorted(os.listdir(remotedir)),
+                                     ['f0.txt', 'f1.txt'])
+
+                os.remove(localdir + '/f1.txt')
+                deadline = time.time() + 10
+                while ('f1.txt' in os.listdir(remotedir)
+                       and time.time() < deadline):
+                    time.sleep(0.1)
+                self.assertListEqual(os.listdir(remotedir), ['f0.txt'])
+                syncer.stop()
+        finally:
+            (tffilesync._WATCHDOG_FOUND, tffilesync._POLL_INTERVAL_S,
+             tffilesync._FULL_SYNC_INTERVAL_S) = saved
+
+    def test_manifest_held_back_on_shard_failure(self):
+        # A checkpoint manifest ('checkpoint', *.index) must not reach the
+        # remote dir while a sibling data shard has failed to copy.
+        shard = 'model.ckpt-1.data-00000-of-00001'
+        fail_names = {shard}
+        real_copy = tffilesync._copy_file
+
+        def flaky_copy(src_dir, dest_dir, file_name, mode=None):
+            if file_name in fail_names:
+                return False
+            return real_copy(src_dir, dest_dir, file_name, mode)
+
+        tffilesync._copy_file = flaky_copy
+        try:
+            with tempfile.TemporaryDirectory() as remotedir, \
+                 tempfile.TemporaryDirectory() as localdir:
+                syncer = tffilesync.Syncer(remotedir, localdir)
+                for name in (shard, 'model.ckpt-1.index', 'checkpoint'):
+                    with open(localdir + '/' + name, 'w') as fd:
+                        fd.write('data of ' + name)
+                _kick_sync(syncer)
+                self.assertNotIn(shard, os.listdir(remotedir))
+                self.assertNotIn('model.ckpt-1.index', os.listdir(remotedir))
+                self.assertNotIn('checkpoint', os.listdir(remotedir))
+                self.assertGreater(syncer.copy_failures(), 0)
+
+                # Once the shard can copy, the next pass uploads it and the
+                # manifests together.
+                fail_names.clear()
+                _kick_sync(syncer)
+                self.assertListEqual(
+                    sorted(os.listdir(remotedir)),
+                    ['checkpoint', shard, 'model.ckpt-1.index'])
+                syncer.stop()
+        finally:
+            tffilesync._copy_file = real_copy
+
+    def test_manifest_ignores_unrelated_failures(self):
+        # Only the manifest's own checkpoint gates its upload: a failing
+        # (or hot) file that is not part of the checkpoint must not hold
+        # 'checkpoint' or the .index file back.
+        fail_names = {'train.log'}
+        real_copy = tffilesync._copy_file
+
+        def flaky_copy(src_dir, dest_dir, file_name, mode=None):
+            if file_name in fail_names:
+                return False
+            return real_copy(src_dir, dest_dir, file_name, mode)
+
+        tffilesync._copy_file = flaky_copy
+        try:
+            with tempfile.TemporaryDirectory() as remotedir, \
+                 tempfile.TemporaryDirectory() as localdir:
+                syncer = tffilesync.Syncer(remotedir, localdir)
+                for name in ('model.ckpt-1.data-00000-of-00001',
+                             'model.ckpt-1.index', 'train.log'):
+                    with open(localdir + '/' + name, 'w') as fd:
+                        fd.write('data of ' + name)
+                with open(localdir + '/checkpoint', 'w') as fd:
+                    fd.write('model_checkpoint_path: "model.ckpt-1"\n'
+                             'all_model_checkpoint_paths: "model.ckpt-1"\n')
+                _kick_sync(syncer)
+                self.assertListEqual(
+                    sorted(os.listdir(remotedir)),
+                    ['checkpoint', 'model.ckpt-1.data-00000-of-00001',
+                     'model.ckpt-1.index'])
+                syncer.stop()
+        finally:
+            tffilesync._copy_file = real_copy
+
+    def test_state_persistence(self):
+        with tempfile.TemporaryDirectory() as remotedir, \
+             tempfile.TemporaryDirectory() as localdir:
+            with open(localdir + '/f0.txt', 'w') as fd:
+                fd.write('hello0')
+            syncer = tffilesync.Syncer(remotedir, localdir)
+            _kick_sync(syncer)
+            syncer.stop()
+            self.assertEqual(_read_file(remotedir + '/f0.txt'), 'hello0')
+
+            with open(localdir + '/.tffilesync_state.json', 'r') as fd:
+                state = json.load(fd)
+            self.assertIn('f0.txt', state['files'])
+
+            # A restarted syncer picks up the saved state and keeps syncing.
+            syncer = tffilesync.Syncer(remotedir, localdir)
+            with open(localdir + '/f1.txt', 'w') as fd:
+                fd.write('hello1')
+            _kick_sync(syncer)
+            self.assertEqual(_read_file(remotedir + '/f1.txt'), 'hello1')
             syncer.stop()
 
 
+class TestDiff(unittest.TestCase):
+    def _snapshot(self, entries):
+        snap = tffilesync._DirSnapshot()
+        for name, length, mtime_nsec in entries:
+            snap.set(name, length, mtime_nsec)
+        return snap
+
+    def test_small_directory(self):
+        # Below _VECTOR_DIFF_MIN, names are aligned through the dict.
+        old = self._snapshot([('a', 1, 10), ('b', 2, 20), ('c', 3, 30)])
+        new = self._snapshot([('a', 1, 10),   # unchanged
+                              ('b', 9, 20),   # length changed, mtime equal
+                              ('c', 3, 99),   # mtime changed, length equal
+                              ('d', 4, 40)])  # missing from old
+        self.assertListEqual(tffilesync._diff(old, new), ['b', 'c', 'd'])
+        self.assertListEqual(tffilesync._diff(old, old), [])
+        self.assertListEqual(tffilesync._diff(new, old), ['b', 'c'])
+
+    def test_large_directory(self):
+        # At and above _VECTOR_DIFF_MIN entries, names are aligned with the
+        # vectorized searchsorted path; it must agree with the small path.
+        n = tffilesync._VECTOR_DIFF_MIN + 50
+        old = self._snapshot([('f%04d' % i, i, i * 7) for i in range(n)])
+        entries = []
+        want = []
+        for i in range(n):
+            name, length, mtime_nsec = 'f%04d' % i, i, i * 7
+            if i % 17 == 0:
+                length += 1 << 32  # changed length only, beyond 32 bits
+                want.append(name)
+            elif i % 19 == 0:
+                mtime_nsec += 1  # changed mtime only
+                want.append(name)
+            entries.append((name, length, mtime_nsec))
+        for i in range(5):
+            entries.append(('new%d' % i, 1, 1))  # missing from old
+            want.append('new%d' % i)
+        new = self._snapshot(entries)
+        self.assertListEqual(sorted(tffilesync._diff(old, new)), sorted(want))
+        self.assertListEqual(tffilesync._diff(old, old), [])
+        # discard() swap-removes and must invalidate the cached sort order.
+        old.discard('f0100')
+        self.assertIn('f0100', tffilesync._diff(old, new))
+
+    def test_discard_swap_remove(self):
+        old = self._snapshot([('a', 1, 10), ('b', 2, 20), ('c', 3, 30),
+                              ('d', 4, 40)])
+        old.discard('b')  # swaps 'd' into b's slot
+        new = self._snapshot([('a', 1, 10), ('b', 2, 20), ('c', 3, 30),
+                              ('d', 4, 40)])
+        self.assertListEqual(tffilesync._diff(old, new), ['b'])
+        self.assertListEqual(tffilesync._diff(new, old), [])
+
+
 if __name__ == '__main__':
     unittest.main()